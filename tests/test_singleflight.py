@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+from web_agent import _singleflight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        inflight = {}
+        results = await asyncio.gather(*(_singleflight(inflight, "k", fetch) for _ in range(5)))
+        assert results == [1] * 5
+        assert inflight == {}
+
+    asyncio.run(main())
+    assert calls == 1
+
+
+def test_cancelled_task_does_not_evict_its_replacement():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        inflight = {}
+        # The only waiter gives up, which cancels the shared task
+        first = asyncio.create_task(_singleflight(inflight, "k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        # A caller arriving before the cancelled task finishes starts a replacement
+        second = asyncio.create_task(_singleflight(inflight, "k", fetch))
+        await asyncio.sleep(0.01)
+        # The cancelled task's cleanup must leave the replacement in place for later callers
+        third = asyncio.create_task(_singleflight(inflight, "k", fetch))
+        assert await second == "done"
+        assert await third == "done"
+        assert inflight == {}
+
+    asyncio.run(main())
+    assert calls == 2
@@ -1,25 +1,37 @@
-from typing import Dict, List, Optional, Union, Any
-from fastapi import FastAPI, HTTPException, Response
+from typing import Dict, List, Optional, Tuple, Union, Any
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.gzip import GZipMiddleware
-from bs4 import BeautifulSoup
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from selectolax.lexbor import LexborHTMLParser
 from pydantic import BaseModel, Field
 from mirascope.core import prompt_template
-from mirascope.core.groq import groq_call
 from mirascope.core.gemini import gemini_call
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
-from youtube_transcript_api import YouTubeTranscriptApi
 import re
 import time
+import contextvars
+import contextlib
 from collections import deque
 import random
 from datetime import datetime
 import asyncio
 from cachetools import TTLCache
-from functools import lru_cache
-import aiohttp
+import httpx
+import redis.asyncio as redis
 from typing import Dict, List
 import os
-import json
+import itertools
+from urllib.parse import urlsplit, urlunsplit
+import logging
+import logging.handlers
+import queue
+import hashlib
+import weakref
+import unicodedata
+import orjson
+import zstandard
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,33 +44,263 @@ if not api_key:
 # Export the API key to environment
 os.environ["GOOGLE_API_KEY"] = api_key
 
+# Log through a queue so handler I/O runs on the listener thread, not the event loop
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+
+logger = logging.getLogger("hayhai")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+
+# Optional Redis instance shared by all workers (configure it with maxmemory-policy allkeys-lru)
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = redis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Bodies stored in Redis are zstd-compressed once they're big enough to benefit;
+# compressed values are recognized by the zstd frame magic, which JSON can't start with
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+_ZSTD_MIN_SIZE = 512
+_zstd_compressor = zstandard.ZstdCompressor(level=3)
+_zstd_decompressor = zstandard.ZstdDecompressor()
+
+def _pack(value: bytes) -> bytes:
+    return _zstd_compressor.compress(value) if len(value) >= _ZSTD_MIN_SIZE else value
+
+def _unpack(raw: bytes) -> bytes:
+    return _zstd_decompressor.decompress(raw) if raw.startswith(_ZSTD_MAGIC) else raw
+
+class ResponseCache:
+    """
+    TTL cache for serialized JSON responses. Entries live in Redis when REDIS_URL is
+    set, so every worker shares them, with a small short-lived in-process tier in
+    front so hot keys skip the network round trip; otherwise an in-process TTLCache
+    bounded by total body size (maxsize bytes) is used.
+    """
+    def __init__(self, prefix: str, ttl: int, maxsize: int):
+        self.prefix = prefix
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl, getsizeof=len)
+        self._hot = TTLCache(maxsize=512, ttl=min(ttl, 300))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if redis_client is None:
+            return self._local.get(key)
+        if (value := self._hot.get(key)) is not None:
+            return value
+        try:
+            value = await redis_client.get(self.prefix + key)
+        except redis.RedisError as e:
+            logger.warning("Redis get failed, treating as a miss: %s", e)
+            return None
+        if value is not None:
+            value = self._hot[key] = _unpack(value)
+        return value
+
+    async def set(self, key: str, value: bytes):
+        if redis_client is None:
+            self._local[key] = value
+            return
+        self._hot[key] = value
+        try:
+            await redis_client.set(self.prefix + key, _pack(value), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning("Redis set failed: %s", e)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Look up several keys with a single Redis round trip"""
+        if redis_client is None:
+            return [self._local.get(key) for key in keys]
+        values = [self._hot.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if not missing:
+            return values
+        try:
+            fetched = await redis_client.mget([self.prefix + keys[i] for i in missing])
+        except redis.RedisError as e:
+            logger.warning("Redis mget failed, treating as misses: %s", e)
+            return values
+        for i, value in zip(missing, fetched):
+            if value is not None:
+                values[i] = self._hot[keys[i]] = _unpack(value)
+        return values
+
+    async def set_many(self, items: List[Tuple[str, bytes]]):
+        """Store several entries with a single pipelined Redis round trip"""
+        if redis_client is None:
+            for key, value in items:
+                self._local[key] = value
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key, value in items:
+                    self._hot[key] = value
+                    pipe.set(self.prefix + key, _pack(value), ex=self.ttl)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis pipelined set failed: %s", e)
+
 # Initialize caches
 SEARCH_CACHE = TTLCache(maxsize=100, ttl=3600)  # 1 hour TTL
-CONTENT_CACHE = TTLCache(maxsize=500, ttl=7200)  # 2 hours TTL
-QUERY_CACHE = TTLCache(maxsize=100, ttl=3600)   # 1 hour TTL
-SOURCE_EVAL_CACHE = TTLCache(maxsize=200, ttl=7200)  # 2 hours TTL
+# Page text is budgeted by total characters so one huge page can't crowd out many small ones
+CONTENT_CACHE = TTLCache(maxsize=32 * 1024 * 1024, ttl=7200, getsizeof=len)  # 2 hours TTL
+# Response bodies are budgeted by bytes, like page text, rather than by entry count
+QUERY_CACHE = ResponseCache("qi:", ttl=3600, maxsize=8 * 1024 * 1024)   # 1 hour TTL
+SOURCE_EVAL_CACHE = ResponseCache("se:", ttl=7200, maxsize=16 * 1024 * 1024)  # 2 hours TTL
+# Single-source evaluations keyed by (question, url), so overlapping source sets share work
+SOURCE_EVAL_ITEM_CACHE = ResponseCache("sei:", ttl=7200, maxsize=16 * 1024 * 1024)  # 2 hours TTL
+# Streamed single-prompt evaluations, kept apart from the merged per-source ones in SOURCE_EVAL_CACHE
+SOURCE_EVAL_STREAM_CACHE = ResponseCache("ses:", ttl=7200, maxsize=8 * 1024 * 1024)  # 2 hours TTL
+SEARCH_TYPE_CACHE = TTLCache(maxsize=1024, ttl=86400)  # 24 hours TTL
+TRANSCRIPT_CACHE = TTLCache(maxsize=500, ttl=86400)  # 24 hours TTL
+
+# Page fetches currently in progress, keyed by URL like CONTENT_CACHE
+_CONTENT_INFLIGHT: Dict[str, asyncio.Task] = {}
+# Search type classifications currently in progress, keyed like SEARCH_TYPE_CACHE
+_SEARCH_TYPE_INFLIGHT: Dict[str, asyncio.Task] = {}
+# Query interpretations and source evaluations currently in progress, keyed like their caches
+_INTERPRET_INFLIGHT: Dict[str, asyncio.Task] = {}
+_SOURCE_EVAL_INFLIGHT: Dict[str, asyncio.Task] = {}
+
+# Precompiled patterns
+_YT_ID_RE = re.compile(r'(?:youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]+)')
+_WS_RE = re.compile(r'\s+')
+# Curly quotes survive NFKC, so fold them to their ASCII forms explicitly
+_QUOTE_TABLE = str.maketrans({'\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"'})
+_YT_HOSTS = frozenset({'youtube.com', 'www.youtube.com', 'm.youtube.com', 'youtu.be'})
+
+# Quote/backslash/newline cleanup applied to transcript text in a single pass
+_CLEAN_TABLE = str.maketrans({'"': "'", '\\': None, '\n': ' ', '\r': ' '})
 
 load_dotenv()
 
 app = FastAPI(
     title="HayhaiSearch API",
     description="An intelligent search API that combines Qwant search with AI processing",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+class NDJSONAwareGZipMiddleware(GZipMiddleware):
+    """
+    GZip responses except NDJSON streams: GZipMiddleware buffers compressed output
+    until the body ends, which would hold back every streamed line
+    """
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and any(
+            name == b"accept" and b"application/x-ndjson" in value for name, value in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
 # Add compression middleware
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.add_middleware(NDJSONAwareGZipMiddleware, minimum_size=1000)
+
+class RequestDeadlineMiddleware:
+    """
+    Record the client's x-timeout-ms budget so Gemini waits and retries stop once it's spent.
+    Plain ASGI, so responses pass through without an extra stream wrapper.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"x-timeout-ms":
+                    try:
+                        request_deadline.set(time.monotonic() + float(value) / 1000)
+                    except ValueError:
+                        pass
+                    break
+        await self.app(scope, receive, send)
+
+app.add_middleware(RequestDeadlineMiddleware)
+
+# Browser-like headers used when fetching page content
+CONTENT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'DNT': '1',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'max-age=0',
+}
+
+# Upper bound on the bytes read from a single page; article text fits well within it
+MAX_CONTENT_BYTES = 1024 * 1024
+# Pages declaring a larger body than this are skipped without reading
+MAX_CONTENT_LENGTH = 2 * 1024 * 1024
+# Characters of extracted text kept per page
+MAX_CONTENT_CHARS = 10000
+
+# Process-wide cap on concurrent page fetches, and a per-URL time budget
+_FETCH_SEM = asyncio.Semaphore(16)
+FETCH_TIMEOUT = 15
+
+@app.on_event("startup")
+async def start_logging():
+    """Start the background thread that writes queued log records"""
+    _log_listener.start()
+
+@app.on_event("shutdown")
+async def stop_logging():
+    """Flush queued log records and stop the listener thread"""
+    _log_listener.stop()
+
+@app.on_event("startup")
+async def configure_thread_pool():
+    """Size the default executor behind asyncio.to_thread (HTML parsing, transcripts)"""
+    if size := os.getenv("THREAD_POOL_SIZE"):
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=int(size)))
+
+@app.on_event("startup")
+async def open_http_client():
+    """Create the shared HTTP/2 connection pool used for content fetches"""
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        headers=CONTENT_HEADERS,
+        follow_redirects=True,
+        verify=False,
+        limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=20,
+            keepalive_expiry=60
+        ),
+        # More aggressive timeout settings
+        timeout=httpx.Timeout(
+            10.0,         # Default timeout
+            connect=5.0,  # Connection timeout
+            read=5.0      # Socket read timeout
+        )
+    )
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close the shared content fetch, Qwant and Redis clients"""
+    await app.state.http_client.aclose()
+    await _qwant.close()
+    if redis_client is not None:
+        await redis_client.aclose()
 
 # Request and Response Models
 class SearchRequest(BaseModel):
     question: str = Field(..., description="The search query or question to be answered")
-    max_results: int = Field(default=6, description="Maximum number of search results to process")
+    max_results: int = Field(default=6, ge=1, le=20, description="Maximum number of search results to process")
 
 class QueryInterpretRequest(BaseModel):
     question: str = Field(..., description="The original search query to be analyzed and enhanced")
 
 class SourceEvaluationRequest(BaseModel):
-    sources: List[str] = Field(..., description="List of source URLs to evaluate")
+    sources: List[str] = Field(..., max_length=20, description="List of source URLs to evaluate (at most 20)")
     question: str = Field(..., description="The original search query for context")
 
 class SearchType(BaseModel):
@@ -93,65 +335,199 @@ class SourceEvaluationResponse(BaseModel):
     recommended_sources: List[str] = Field(..., description="URLs of the most reliable and relevant sources")
     improvement_suggestions: Optional[str] = Field(None, description="Suggestions for better source selection")
 
+class SourceEvaluationBatch(BaseModel):
+    results: List[SourceEvaluationResponse] = Field(..., description="One source evaluation per request, in request order")
+
 class RateLimiter:
     def __init__(self, rpm_limit: int = 15, tpm_limit: int = 1_000_000):
         self.rpm_limit = rpm_limit
         self.tpm_limit = tpm_limit
         self.requests = deque()
+        # One (timestamp, token_count) entry per request, plus a running sum
         self.tokens = deque()
+        self.token_sum = 0
         self.window = 60
         self._lock = asyncio.Lock()
     
-    async def _clean_old_entries(self, queue: deque, current_time: float):
-        while queue and current_time - queue[0] >= self.window:
-            queue.popleft()
+    def _clean_requests(self, current_time: float):
+        while self.requests and current_time - self.requests[0] >= self.window:
+            self.requests.popleft()
     
-    async def can_make_request(self, tokens: int = 0) -> bool:
-        async with self._lock:
-            current_time = time.time()
-            await self._clean_old_entries(self.requests, current_time)
-            await self._clean_old_entries(self.tokens, current_time)
-            
-            return (len(self.requests) < self.rpm_limit and 
-                    len(self.tokens) + tokens <= self.tpm_limit)
+    def _clean_tokens(self, current_time: float):
+        while self.tokens and current_time - self.tokens[0][0] >= self.window:
+            self.token_sum -= self.tokens.popleft()[1]
     
-    async def add_request(self, tokens: int = 0):
+    async def acquire(self, tokens: int = 0) -> float:
+        """
+        Atomically check capacity and reserve a request slot.
+        Returns 0.0 once reserved, otherwise the seconds to wait before trying again;
+        the caller sleeps so the lock is never held across a sleep.
+        """
+        if tokens > self.tpm_limit:
+            # Could never fit in any window, so waiting would loop forever
+            raise ValueError(f"{tokens} tokens exceeds the limit of {self.tpm_limit} per minute")
         async with self._lock:
             current_time = time.time()
-            self.requests.append(current_time)
-            if tokens > 0:
-                for _ in range(tokens):
-                    self.tokens.append(current_time)
+            self._clean_requests(current_time)
+            self._clean_tokens(current_time)
+            
+            if (len(self.requests) < self.rpm_limit and
+                    self.token_sum + tokens <= self.tpm_limit):
+                self.requests.append(current_time)
+                if tokens > 0:
+                    self.tokens.append((current_time, tokens))
+                    self.token_sum += tokens
+                return 0.0
+            
+            if len(self.requests) >= self.rpm_limit:
+                oldest = self.requests[0]
+            else:
+                # The token budget is what's blocking; wait for the oldest tokens to age out
+                oldest = self.tokens[0][0]
+            return max(self.window - (current_time - oldest), 0.01)
+
+    def headroom(self) -> int:
+        """Request slots still free in the current window"""
+        self._clean_requests(time.time())
+        return self.rpm_limit - len(self.requests)
 
 # Create a global rate limiter instance
 gemini_rate_limiter = RateLimiter()
+# Cap on Gemini calls in flight at once; excess calls queue here instead of piling onto the API
+GEMINI_SEM = asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")))
+
+# Monotonic deadline of the request being served, from its x-timeout-ms header
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+def _deadline_exceeded() -> HTTPException:
+    return HTTPException(status_code=504, detail="Request deadline exceeded")
+
+async def await_within_deadline(awaitable):
+    """Await on behalf of the current request, giving up once its deadline passes"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, deadline - time.monotonic())
+    except asyncio.TimeoutError:
+        raise _deadline_exceeded()
+
+async def _without_deadline(factory):
+    """Run factory() with no request deadline, for work shared by several requests"""
+    request_deadline.set(None)
+    return await factory()
+
+@contextlib.asynccontextmanager
+async def gemini_slot():
+    """
+    Wait for the rate limiter and a GEMINI_SEM slot, failing fast when the current
+    request's deadline would pass before the call could start
+    """
+    while wait_time := await gemini_rate_limiter.acquire():
+        deadline = request_deadline.get()
+        if deadline is not None and time.monotonic() + wait_time >= deadline:
+            raise _deadline_exceeded()
+        await asyncio.sleep(wait_time)
+    await await_within_deadline(GEMINI_SEM.acquire())
+    try:
+        yield
+    finally:
+        GEMINI_SEM.release()
 
 def with_retries(func):
     """Decorator to add retry logic with exponential backoff"""
     async def wrapper(*args, **kwargs):
         max_retries = 5
         base_delay = 1
+        status_code = 429
         
         for attempt in range(max_retries):
             try:
-                if not await gemini_rate_limiter.can_make_request():
-                    wait_time = 60 - (time.time() - gemini_rate_limiter.requests[0])
-                    await asyncio.sleep(wait_time)
-                
-                result = await func(*args, **kwargs)
-                await gemini_rate_limiter.add_request()
-                return result
+                async with gemini_slot():
+                    return await func(*args, **kwargs)
                 
+            except (google_exceptions.TooManyRequests, google_exceptions.ServerError) as e:
+                # Rate limited (429) or transient 5xx: back off with jitter and retry
+                status_code = 429 if isinstance(e, google_exceptions.TooManyRequests) else 503
+                delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+                deadline = request_deadline.get()
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    # The client will have given up before the next attempt could finish
+                    raise _deadline_exceeded()
+                await asyncio.sleep(delay)
+            except HTTPException:
+                raise
             except Exception as e:
-                if "429" in str(e):
-                    delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                    await asyncio.sleep(delay)
-                    continue
                 raise HTTPException(status_code=500, detail=str(e))
         
-        raise HTTPException(status_code=429, detail="Max retries exceeded")
+        raise HTTPException(status_code=status_code, detail="Max retries exceeded")
     return wrapper
 
+def normalize_question(question: str) -> str:
+    """
+    Canonicalize a question for use as a cache key, so trivial variants (Unicode forms,
+    smart quotes, case, spacing, trailing punctuation) share one entry
+    """
+    question = unicodedata.normalize("NFKC", question).translate(_QUOTE_TABLE).casefold()
+    return _WS_RE.sub(' ', question).strip().rstrip('?!. ')
+
+def normalize_url(url: str) -> str:
+    """
+    Canonicalize a source URL: lowercase scheme and host, drop the fragment, utm_*
+    tracking parameters and any trailing slash. Unparseable URLs are kept as given.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    query = '&'.join(p for p in parts.query.split('&') if p and not p.startswith('utm_'))
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower().rstrip('.'),
+        parts.path.rstrip('/') or '/',
+        query,
+        ''
+    ))
+
+def dump_json(model: BaseModel, **kwargs) -> bytes:
+    """Serialize a model straight to JSON bytes, skipping the intermediate str"""
+    return model.__pydantic_serializer__.to_json(model, **kwargs)
+
+def hash_key(material: Any) -> str:
+    """Fixed-size cache key from JSON-serializable key material"""
+    return hashlib.blake2b(orjson.dumps(material), digest_size=16).hexdigest()
+
+# Number of callers currently awaiting each shared _singleflight task
+_SINGLEFLIGHT_WAITERS: "weakref.WeakKeyDictionary[asyncio.Task, int]" = weakref.WeakKeyDictionary()
+
+async def _singleflight(inflight: Dict[Any, asyncio.Task], key: Any, factory):
+    """
+    Run factory() once per key and share the result with every concurrent caller.
+    The shared task is shielded so one caller's cancellation doesn't cancel it for the rest;
+    once the last caller waiting on it is cancelled, the now-unwanted task is cancelled too.
+    The task runs without a request deadline, so one client's budget can't fail the others;
+    each caller's deadline only bounds its own wait.
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_without_deadline(factory))
+        inflight[key] = task
+        # A cancelled task may already have been replaced under its key; only remove our own
+        task.add_done_callback(lambda t: inflight.get(key) is t and inflight.pop(key))
+    _SINGLEFLIGHT_WAITERS[task] = _SINGLEFLIGHT_WAITERS.get(task, 0) + 1
+    try:
+        return await await_within_deadline(asyncio.shield(task))
+    except asyncio.CancelledError:
+        if _SINGLEFLIGHT_WAITERS[task] == 1 and not task.done():
+            # Nobody else wants the result; keep later callers from joining a dying task
+            if inflight.get(key) is task:
+                del inflight[key]
+            task.cancel()
+        raise
+    finally:
+        _SINGLEFLIGHT_WAITERS[task] -= 1
+
 class QwantApi:
     BASE_URL = "https://api.qwant.com/v3"
     MAX_RETRIES = 3
@@ -169,7 +545,6 @@ class QwantApi:
             'Accept-Language': 'en-US,en;q=0.5',
             'Referer': 'https://www.qwant.com/',
             'Origin': 'https://www.qwant.com',
-            'Connection': 'keep-alive',
             'Sec-Fetch-Dest': 'empty',
             'Sec-Fetch-Mode': 'cors',
             'Sec-Fetch-Site': 'same-site',
@@ -180,27 +555,43 @@ class QwantApi:
             'Cache-Control': 'no-cache',
         }
         # Create connection pool
-        self.client_session = None
-
-    async def get_session(self) -> aiohttp.ClientSession:
-        if self.client_session is None or self.client_session.closed:
-            self.client_session = aiohttp.ClientSession(
+        self._client = None
+        # Searches currently in progress, keyed like SEARCH_CACHE
+        self._inflight = {}
+
+    async def get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
                 headers=self.headers,
                 cookies=self.cookies,
-                timeout=aiohttp.ClientTimeout(total=30)
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
             )
-        return self.client_session
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
 
-    @lru_cache(maxsize=100)
     async def search(self, q: str, search_type: str = 'web', locale: str = 'en_GB', 
                     offset: int = 0, safesearch: int = 5) -> Optional[Dict]:
         """
         Perform a search using the Qwant API with error handling and caching
         """
-        cache_key = f"{q}:{search_type}:{locale}:{offset}:{safesearch}"
+        cache_key = (q, search_type, locale, offset, safesearch)
         if cache_key in SEARCH_CACHE:
             return SEARCH_CACHE[cache_key]
 
+        # Concurrent identical searches share a single upstream request
+        return await _singleflight(
+            self._inflight,
+            cache_key,
+            lambda: self._search(cache_key, q, search_type, locale, offset, safesearch)
+        )
+
+    async def _search(self, cache_key: Tuple, q: str, search_type: str, locale: str,
+                      offset: int, safesearch: int) -> Optional[Dict]:
         params = {
             'q': q,
             'count': '10',
@@ -214,15 +605,15 @@ class QwantApi:
         }
         
         url = f"{self.BASE_URL}/search/{search_type}"
-        session = await self.get_session()
+        client = await self.get_client()
         
         for attempt in range(self.MAX_RETRIES):
             try:
-                async with session.get(url, params=params) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    SEARCH_CACHE[cache_key] = result
-                    return result
+                response = await client.get(url, params=params)
+                response.raise_for_status()
+                result = orjson.loads(response.content)
+                SEARCH_CACHE[cache_key] = result
+                return result
                     
             except Exception as e:
                 if attempt == self.MAX_RETRIES - 1:
@@ -237,6 +628,9 @@ class QwantApi:
             detail="Max retries exceeded while connecting to Qwant API"
         )
 
+# Shared Qwant client so the connection pool and SEARCH_CACHE are reused across requests
+_qwant = QwantApi()
+
 # Core search functionality
 @with_retries
 @gemini_call("gemini-2.0-flash-exp", response_model=SearchType, json_mode=True)
@@ -263,12 +657,28 @@ ASSISTANT:
 I will choose the correct search type and justify it briefly based on the guidelines.
 """
 )
-async def determine_search_type(question: str) -> SearchType:
+async def _determine_search_type(question: str) -> SearchType:
     """
     Decide the most appropriate Qwant search type for a given query.
     """
     ...
 
+async def determine_search_type(question: str) -> SearchType:
+    """
+    Decide the search type, reusing earlier decisions for the same question.
+    """
+    cache_key = normalize_question(question)
+    if cache_key in SEARCH_TYPE_CACHE:
+        return SEARCH_TYPE_CACHE[cache_key]
+
+    result = await _singleflight(
+        _SEARCH_TYPE_INFLIGHT,
+        cache_key,
+        lambda: _determine_search_type(question)
+    )
+    SEARCH_TYPE_CACHE[cache_key] = result
+    return result
+
 def is_video_query(question: str, search_type: str) -> bool:
     """Check if the query is video-related."""
     video_keywords = ['video', 'youtube', 'watch', 'clip', 'footage']
@@ -277,116 +687,125 @@ def is_video_query(question: str, search_type: str) -> bool:
         any(keyword in question.lower() for keyword in video_keywords)
     )
 
+def _is_youtube(url: str) -> bool:
+    """Check whether a URL points at a YouTube host."""
+    host = urlsplit(url).hostname
+    if not host:
+        return False
+    return host in _YT_HOSTS or host.endswith('.youtube.com')
+
+def _result_items(result_data: Optional[Dict]) -> Any:
+    """Return the result items of a Qwant response, if present"""
+    if result_data and 'data' in result_data and 'result' in result_data['data']:
+        return result_data['data']['result'].get('items')
+    return None
+
+def _iter_urls(items_data: Any, skip_youtube: bool):
+    """Yield URLs from Qwant result items and their sub-items"""
+    if not items_data:
+        return
+        
+    if isinstance(items_data, dict) and 'mainline' in items_data:
+        items_data = items_data['mainline']
+        
+    for item in items_data:
+        if 'url' in item:
+            candidates = (item,)
+        elif isinstance(item, dict) and 'items' in item:
+            candidates = item['items']
+        else:
+            continue
+            
+        for candidate in candidates:
+            if 'url' not in candidate:
+                continue
+            url = candidate['url']
+            # Skip YouTube URLs if not a video search
+            if skip_youtube and _is_youtube(url):
+                continue
+            yield url
+
 async def qwant_search(query: str, search_type: str, max_results: int = 6) -> Dict[str, str]:
     """
     Use Qwant to get information about the query with optimized parallel processing
     """
-    print(f"Searching Qwant for '{query}' using {search_type} search...")
+    logger.info("Searching Qwant for %r using %s search", query, search_type)
     search_results = {}
     urls = []
-    qwant = QwantApi()
+    qwant = _qwant
     
-    # Perform multiple search types in parallel for comprehensive results
-    parallel_searches = []
     results = None
-    secondary_results = None
     
     try:
         if (search_type == 'web'):
-            # For web searches, also fetch news in parallel for better coverage
-            parallel_searches = [
-                qwant.search(query, search_type='web'),
-                qwant.search(query, search_type='news')
-            ]
-            results_list = await asyncio.gather(*parallel_searches, return_exceptions=True)
-            
-            # Handle potential errors in parallel searches
-            results = results_list[0] if not isinstance(results_list[0], Exception) else None
-            secondary_results = results_list[1] if not isinstance(results_list[1], Exception) else None
-            
-            # If web search failed, try news as primary
-            if not results and secondary_results:
-                results = secondary_results
-                secondary_results = None
+            # News results are only requested below if the web results fall short
+            try:
+                results = await qwant.search(query, search_type='web')
+            except Exception as e:
+                logger.warning("Error in web search: %s", e)
         else:
             # For non-web searches, just use the requested type
             try:
                 results = await qwant.search(query, search_type=search_type)
             except Exception as e:
-                print(f"Error in primary search: {str(e)}")
+                logger.warning("Error in primary search: %s", e)
                 # Fall back to web search if the primary search type fails
                 try:
                     results = await qwant.search(query, search_type='web')
                 except Exception as e:
-                    print(f"Error in fallback search: {str(e)}")
+                    logger.warning("Error in fallback search: %s", e)
                     results = None
     
     except Exception as e:
-        print(f"Error in search process: {str(e)}")
+        logger.error("Error in search process: %s", e)
         return {"_urls": [], "error": str(e)}
 
     is_video_search = is_video_query(query, search_type)
+    seen = set()
     
-    def extract_urls_from_items(items_data, url_list, count):
-        """Helper function to extract URLs from Qwant result items"""
-        if not items_data:
-            return count
-            
-        if isinstance(items_data, dict) and 'mainline' in items_data:
-            items_data = items_data['mainline']
-            
-        for item in items_data:
-            if count >= max_results:
-                break
-                
-            if 'url' in item:
-                url = item['url']
-                # Skip YouTube URLs if not a video search
-                if not is_video_search and ('youtube.com' in url or 'youtu.be' in url):
-                    continue
-                # Skip duplicate URLs
-                if url not in url_list:
-                    url_list.append(url)
-                    count += 1
-            elif isinstance(item, dict) and 'items' in item:
-                for subitem in item['items']:
-                    if count >= max_results:
-                        break
-                    if 'url' in subitem:
-                        url = subitem['url']
-                        if not is_video_search and ('youtube.com' in url or 'youtu.be' in url):
-                            continue
-                        if url not in url_list:
-                            url_list.append(url)
-                            count += 1
-        return count
+    def iter_unique_urls(result_data):
+        """Yield URLs from a Qwant response that haven't been collected yet"""
+        for url in _iter_urls(_result_items(result_data), not is_video_search):
+            if url not in seen:
+                seen.add(url)
+                yield url
     
-    # Extract URLs from primary results
-    all_urls = []
-    count = 0
+    all_urls = list(itertools.islice(iter_unique_urls(results), max_results))
     
-    if results and 'data' in results and 'result' in results['data'] and 'items' in results['data']['result']:
-        count = extract_urls_from_items(results['data']['result']['items'], all_urls, count)
-    
-    # If we have secondary results and need more URLs, extract from there too
-    if secondary_results and count < max_results:
-        if ('data' in secondary_results and 
-            'result' in secondary_results['data'] and 
-            'items' in secondary_results['data']['result']):
-            count = extract_urls_from_items(
-                secondary_results['data']['result']['items'], 
-                all_urls, 
-                count
-            )
+    # For web searches, top up from news for better coverage (or as the
+    # primary source if the web search failed), but only when needed
+    if search_type == 'web' and len(all_urls) < max_results:
+        try:
+            news_results = await qwant.search(query, search_type='news')
+        except Exception as e:
+            logger.warning("Error in news search: %s", e)
+            news_results = None
+        all_urls.extend(itertools.islice(iter_unique_urls(news_results), max_results - len(all_urls)))
     
     # Fetch content in parallel with improved error handling
     if all_urls:
-        semaphore = asyncio.Semaphore(8)  # Limit concurrent requests
+        async def fetch_with_timeout(url):
+            # Bound each fetch so one slow origin can't stall the whole search
+            return await asyncio.wait_for(get_content(url, is_video_search), timeout=FETCH_TIMEOUT)
+        
+        async def fetch_first_content(candidate_urls):
+            """Race the candidate URLs and return the first non-empty content"""
+            pending = {asyncio.create_task(fetch_with_timeout(u)) for u in candidate_urls}
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None and (content := task.result()) and content.strip():
+                            return content
+            finally:
+                for task in pending:
+                    task.cancel()
+            return None
         
         async def fetch_url_with_semaphore(url):
-            async with semaphore:
+            async with _FETCH_SEM:
                 try:
-                    content = await get_content(url, is_video_search)
+                    content = await fetch_with_timeout(url)
                     if content and content.strip():
                         return url, content
                     
@@ -394,27 +813,25 @@ async def qwant_search(query: str, search_type: str, max_results: int = 6) -> Di
                     if 'github.com' in url:
                         # Try raw content URL for GitHub
                         raw_url = url.replace('github.com', 'raw.githubusercontent.com')
-                        raw_url = raw_url.replace('/blob/', '/')
-                        content = await get_content(raw_url, is_video_search)
-                        if content and content.strip():
-                            return url, content
-                            
+                        alt_urls = [raw_url.replace('/blob/', '/')]
                     elif 'docs.' in url:
                         # Try alternative doc URLs
                         alt_urls = [
                             url.replace('docs.', 'www.'),
                             url.replace('docs.', '')
                         ]
-                        for alt_url in alt_urls:
-                            content = await get_content(alt_url, is_video_search)
-                            if content and content.strip():
-                                return url, content
+                    else:
+                        alt_urls = []
+                    
+                    # Alternatives are fetched concurrently; the first usable one wins
+                    if alt_urls and (content := await fetch_first_content(alt_urls)):
+                        return url, content
                                 
                 except Exception as e:
-                    print(f"Error fetching {url}: {str(e)}")
+                    logger.warning("Error fetching %s: %s", url, e)
                 return None
         
-        tasks = [fetch_url_with_semaphore(url) for url in all_urls[:max_results]]
+        tasks = [fetch_url_with_semaphore(url) for url in all_urls]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
         # Filter out None results and exceptions, add to search_results
@@ -430,163 +847,187 @@ async def qwant_search(query: str, search_type: str, max_results: int = 6) -> Di
 
 def extract_youtube_id(url: str) -> Union[str, None]:
     """Extract YouTube video ID from URL."""
+    match = _YT_ID_RE.search(url)
+    return match.group(1) if match else None
+
+def _fetch_transcript_text(video_id: str) -> str:
+    """Blocking transcript lookup and cleanup; runs in a worker thread."""
+    # Imported lazily: only video searches ever need it
+    from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound
+
+    transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
     try:
-        pattern = r'(?:youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]+)'
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-        return None
-    except Exception as e:
-        print(f"Error extracting YouTube ID: {e}")
-        return None
+        transcript = transcript_list.find_transcript(['en'])
+    except NoTranscriptFound:
+        # If English isn't available, take any transcript and translate it
+        transcript = next(iter(transcript_list), None)
+        if transcript is None:
+            return ""
+        transcript = transcript.translate('en')
+
+    transcript_data = transcript.fetch()
+    # Clean and format transcript text to avoid JSON issues in one pass over the joined text
+    raw_text = " ".join(entry['text'] for entry in transcript_data)
+    cleaned_text = _WS_RE.sub(' ', raw_text.translate(_CLEAN_TABLE)).strip()
+    return f"[Transcript] {cleaned_text}"
 
 async def get_youtube_transcript(video_id: str) -> str:
     """Get English transcript for a YouTube video."""
+    if video_id in TRANSCRIPT_CACHE:
+        return TRANSCRIPT_CACHE[video_id]
+
     try:
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        try:
-            transcript = transcript_list.find_transcript(['en'])
-        except:
-            try:
-                # If English isn't available, try to get any transcript and translate it
-                transcript = transcript_list.find_transcript(transcript_list.transcript_data.keys())
-                transcript = transcript.translate('en')
-            except Exception as e:
-                print(f"Translation error: {e}")
-                return ""
-        
-        transcript_data = transcript.fetch()
-        # Clean and format transcript text to avoid JSON issues
-        cleaned_text = " ".join([
-            entry['text'].replace('"', "'").replace('\n', ' ').strip()
-            for entry in transcript_data
-        ])
-        return f"[Transcript] {cleaned_text}"
+        # The transcript API is blocking, so the whole lookup runs in a worker thread
+        result = await asyncio.to_thread(_fetch_transcript_text, video_id)
     except Exception as e:
-        print(f"Error fetching transcript: {e}")
+        logger.warning("Error fetching transcript for %s: %s", video_id, e)
         return ""
 
+    if result:
+        TRANSCRIPT_CACHE[video_id] = result
+    return result
+
+def _content_scope(node) -> int:
+    """Rank a node by its enclosing container: 0 inside an article, 1 inside main, 2 elsewhere"""
+    rank = 2
+    parent = node.parent
+    while parent is not None:
+        if parent.tag == 'article':
+            return 0
+        if parent.tag == 'main':
+            rank = 1
+        parent = parent.parent
+    return rank
+
+def _extract_paragraphs(body: bytes, encoding: str) -> List[str]:
+    """
+    Decode an HTML page and extract its main text blocks, preferring article and main content
+    """
+    html = body.decode(encoding, errors='replace')
+
+    # selectolax's lexbor backend is a fast, spec-compliant C parser
+    tree = LexborHTMLParser(html)
+
+    # Remove unwanted elements
+    tree.strip_tags(['script', 'style', 'nav', 'footer', 'iframe'])
+
+    # Single pass over the text blocks: each node's text is extracted once and
+    # bucketed by scope (article, main) or kept as a fallback candidate
+    scoped = ([], [])
+    fallback = []
+    for elem in tree.css('h1, h2, h3, h4, p'):
+        text = elem.text(strip=True)
+        if len(text) <= 20:
+            continue
+        rank = _content_scope(elem)
+        if rank < 2:
+            scoped[rank].append(text)
+        if len(text) > 30 and elem.tag != 'h4':
+            fallback.append(text)
+
+    data = []
+    seen = set()
+    size = 0
+
+    def take(texts):
+        nonlocal size
+        for text in texts:
+            if size >= MAX_CONTENT_CHARS:
+                return
+            if text not in seen:
+                data.append(text)
+                seen.add(text)
+                size += len(text) + 1
+
+    # Extract content with priority
+    take(scoped[0])
+    take(scoped[1])
+
+    # Fallback to regular content if needed
+    if len(data) < 3:
+        take(fallback)
+
+    return data
+
 async def get_content(url: str, is_video_search: bool = False) -> str:
     """
     Fetch and parse content from a URL with caching, improved error handling and retry mechanism
     """
-    cache_key = f"{url}:{is_video_search}"
-    if cache_key in CONTENT_CACHE:
-        return CONTENT_CACHE[cache_key]
+    video_id = extract_youtube_id(url)
+    if video_id:
+        if not is_video_search:
+            return ""
+        # Transcripts are cached per video in TRANSCRIPT_CACHE; fall back to the page itself
+        if transcript := await get_youtube_transcript(video_id):
+            return transcript
 
+    # Page text doesn't depend on the search type, so it's cached by URL alone
+    if url in CONTENT_CACHE:
+        return CONTENT_CACHE[url]
+
+    # Concurrent searches needing the same page share a single fetch
+    return await _singleflight(_CONTENT_INFLIGHT, url, lambda: _fetch_content(url))
+
+async def _fetch_content(url: str) -> str:
     data = []
     max_retries = 3
     base_delay = 1
 
     try:
-        video_id = extract_youtube_id(url)
-        if video_id and is_video_search:
-            transcript = await get_youtube_transcript(video_id)
-            if transcript:
-                cleaned_transcript = transcript.replace('"', "'").replace('\\', '').strip()
-                data.append(cleaned_transcript)
-                content = " ".join(data) if data else ""
-                CONTENT_CACHE[cache_key] = content
-                return content
-
-        if video_id and not is_video_search:
-            return ""
-
-        # More aggressive timeout settings
-        timeout = aiohttp.ClientTimeout(
-            total=10,    # Total timeout
-            connect=5,   # Connection timeout
-            sock_read=5  # Socket read timeout
-        )
-
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'Cache-Control': 'max-age=0',
-        }
-
         for attempt in range(max_retries):
             try:
-                async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-                    async with session.get(url, allow_redirects=True, verify_ssl=False) as response:
-                        if response.status != 200:
-                            if attempt == max_retries - 1:
-                                print(f"Failed to fetch {url} after {max_retries} attempts. Status: {response.status}")
-                                return ""
-                            await asyncio.sleep(base_delay * (2 ** attempt))
-                            continue
-
-                        # Try to detect content type and encoding
+                async with app.state.http_client.stream('GET', url) as response:
+                    status = response.status_code
+                    if status == 200:
+                        # Only text documents are worth parsing
                         content_type = response.headers.get('Content-Type', '').lower()
-                        if 'application/pdf' in content_type or 'image/' in content_type:
+                        if content_type and not (content_type.startswith('text/') or 'html' in content_type):
                             return ""  # Skip binary content
 
-                        try:
-                            content = await response.text()
-                        except UnicodeDecodeError:
-                            content = await response.read()
-                            try:
-                                content = content.decode('utf-8', errors='replace')
-                            except:
-                                return ""
-
-                        # Use html.parser as it's more forgiving with malformed HTML
-                        soup = BeautifulSoup(content, "html.parser", from_encoding='utf-8')
-
-                        # Remove unwanted elements
-                        for element in soup.find_all(['script', 'style', 'nav', 'footer', 'iframe']):
-                            element.decompose()
-
-                        # Extract content with priority
-                        if article := soup.find('article'):
-                            for elem in article.find_all(['h1', 'h2', 'h3', 'h4', 'p']):
-                                text = elem.get_text(strip=True)
-                                if text and len(text) > 20:
-                                    data.append(text)
-
-                        if main := soup.find('main'):
-                            for elem in main.find_all(['h1', 'h2', 'h3', 'h4', 'p']):
-                                text = elem.get_text(strip=True)
-                                if text and len(text) > 20 and text not in data:
-                                    data.append(text)
-
-                        # Fallback to regular content if needed
-                        if len(data) < 3:
-                            for elem in soup.find_all(['h1', 'h2', 'h3', 'p']):
-                                text = elem.get_text(strip=True)
-                                if text and len(text) > 30 and text not in data:
-                                    data.append(text)
-
-                        break  # Success, exit retry loop
-
-            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        content_length = response.headers.get('Content-Length', '')
+                        if content_length.isdigit() and int(content_length) > MAX_CONTENT_LENGTH:
+                            return ""  # Skip oversized pages
+
+                        # Stream the body and stop once the size cap is reached
+                        buf = bytearray()
+                        async for chunk in response.aiter_bytes(65536):
+                            buf.extend(chunk)
+                            if len(buf) >= MAX_CONTENT_BYTES:
+                                break
+                        encoding = response.encoding or 'utf-8'
+
+                # Back off outside the stream so the connection goes back to the pool
+                if status != 200:
+                    if attempt == max_retries - 1:
+                        logger.debug("Failed to fetch %s after %d attempts. Status: %s", url, max_retries, status)
+                        return ""
+                    await asyncio.sleep(base_delay * (2 ** attempt))
+                    continue
+
+                # Decode and parse off the event loop so other fetches keep progressing
+                data = await asyncio.to_thread(_extract_paragraphs, buf, encoding)
+
+                break  # Success, exit retry loop
+
+            except httpx.HTTPError as e:
                 if attempt == max_retries - 1:
-                    print(f"Error fetching {url} after {max_retries} attempts: {str(e)}")
+                    logger.debug("Error fetching %s after %d attempts: %s", url, max_retries, e)
                     return ""
                 await asyncio.sleep(base_delay * (2 ** attempt))
                 continue
 
     except Exception as e:
-        print(f"Unexpected error processing {url}: {str(e)}")
+        logger.warning("Unexpected error processing %s: %s", url, e)
         return ""
 
     # Join the data and limit content size
     content = " ".join(data)
-    if len(content) > 10000:
-        content = content[:10000] + "..."
+    if len(content) > MAX_CONTENT_CHARS:
+        content = content[:MAX_CONTENT_CHARS] + "..."
 
     # Only cache if we actually got content
     if content.strip():
-        CONTENT_CACHE[cache_key] = content
+        CONTENT_CACHE[url] = content
     
     return content
 
@@ -697,16 +1138,45 @@ def clean_text(text: str) -> str:
     """
     Clean the text data for better formatting and readability.
     """
-    # Removing extra spaces and special characters
-    return re.sub(r'\s+', ' ', text).strip()
+    # Collapse whitespace runs in C: str.split() splits on the same characters as \s
+    return " ".join(text.split())
 
 @app.post("/search", response_model=SearchResponse)
-async def search_endpoint(request: SearchRequest, response: Response):
+async def search_endpoint(request: SearchRequest, response: Response, http_request: Request):
     """
     Process a search request and return an AI-enhanced answer with compression
     """
     try:
-        search_type_result = await determine_search_type(request.question)
+        web_task = None
+        # A cached classification is known at once, so revalidation below is checked
+        # before any Qwant request starts and there is nothing to overlap with
+        search_type_result = SEARCH_TYPE_CACHE.get(normalize_question(request.question))
+        if search_type_result is None:
+            # Most questions end up as web searches, so start that Qwant call while the
+            # classifier runs; qwant_search then picks it up from the in-flight map or cache.
+            # Cancelling it also cancels the upstream request unless qwant_search has joined
+            web_task = asyncio.create_task(_qwant.search(request.question, search_type='web'))
+            # qwant_search reports search failures itself; don't warn about this copy
+            web_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            try:
+                search_type_result = await determine_search_type(request.question)
+            except Exception:
+                web_task.cancel()
+                raise
+
+            if search_type_result.search_type != 'web':
+                web_task.cancel()
+
+        # Answers are cached per (question, search type, result count), so clients
+        # revalidating within max-age get a 304 instead of a fresh LLM answer
+        etag_source = f"{request.question}\0{search_type_result.search_type}\0{request.max_results}"
+        etag = 'W/"' + hashlib.blake2b(etag_source.encode(), digest_size=16).hexdigest() + '"'
+        cache_control = "public, max-age=3600"
+        if _etag_matches(http_request.headers.get("if-none-match"), etag):
+            if web_task is not None:
+                web_task.cancel()
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
         search_results = await qwant_search(request.question, search_type_result.search_type, request.max_results)
         
         if not search_results:
@@ -715,7 +1185,8 @@ async def search_endpoint(request: SearchRequest, response: Response):
         result = await extract(request.question, search_results)
         
         # Enable response caching
-        response.headers["Cache-Control"] = "public, max-age=3600"
+        response.headers["Cache-Control"] = cache_control
+        response.headers["ETag"] = etag
         
         return SearchResponse(
             answer=clean_text(result.answer),
@@ -723,6 +1194,9 @@ async def search_endpoint(request: SearchRequest, response: Response):
             search_type=search_type_result.search_type
         )
         
+    except HTTPException:
+        # Keep deliberate statuses (404, deadline 504, retry 429/503) rather than masking them as 500
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -734,8 +1208,6 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 # New function for AI query interpretation
-@with_retries
-@gemini_call("gemini-2.0-flash-exp", response_model=QueryInterpretation, json_mode=True)
 @prompt_template(
 """
 SYSTEM:
@@ -763,15 +1235,21 @@ ASSISTANT:
 I'll analyze this search query and provide an enhanced version with additional context.
 """
 )
-async def interpret_query(query: str) -> QueryInterpretation:
+async def interpret_query_prompt(query: str):
     """
-    Analyze and enhance a user query to improve search results.
+    Prompt to analyze and enhance a user query to improve search results.
     """
     ...
 
+interpret_query = with_retries(
+    gemini_call("gemini-2.0-flash-exp", response_model=QueryInterpretation, json_mode=True)(interpret_query_prompt)
+)
+# Same call streamed as increasingly complete partial models
+interpret_query_stream = gemini_call(
+    "gemini-2.0-flash-exp", response_model=QueryInterpretation, json_mode=True, stream=True
+)(interpret_query_prompt)
+
 # New function for evaluating source credibility and relevance
-@with_retries
-@gemini_call("gemini-2.0-flash-exp", response_model=SourceEvaluationResponse, json_mode=True)
 @prompt_template(
 """
 SYSTEM:
@@ -815,59 +1293,455 @@ ASSISTANT:
 I'll evaluate each source for credibility and relevance to the query.
 """
 )
-async def evaluate_sources(question: str, sources: List[str]) -> SourceEvaluationResponse:
+async def evaluate_sources_prompt(question: str, sources: List[str]):
     """
-    Evaluate the credibility and relevance of each source.
+    Prompt to evaluate the credibility and relevance of each source.
     """
     ...
 
+evaluate_sources = with_retries(
+    gemini_call("gemini-2.0-flash-exp", response_model=SourceEvaluationResponse, json_mode=True)(evaluate_sources_prompt)
+)
+# Same call streamed as increasingly complete partial models
+evaluate_sources_stream = gemini_call(
+    "gemini-2.0-flash-exp", response_model=SourceEvaluationResponse, json_mode=True, stream=True
+)(evaluate_sources_prompt)
+
+# Batched variant of evaluate_sources, used to answer several requests with one call
+@with_retries
+@gemini_call("gemini-2.0-flash-exp", response_model=SourceEvaluationBatch, json_mode=True)
+@prompt_template(
+"""
+SYSTEM:
+You are an expert at evaluating the credibility and relevance of information sources. 
+You will receive several numbered evaluation requests, each with its own query and source URLs.
+Evaluate every request independently, exactly as if it were the only one.
+
+For each source URL, analyze domain reputation, recency and relevance to the query, author expertise, 
+citations, potential bias, factual accuracy and overall information quality.
+
+For your response, provide a valid JSON object with:
+- results: A list with one entry per request, in the same order as the requests
+
+Each entry in results must contain:
+- evaluations: A list of evaluations, one for each source URL of that request
+- overall_quality: A score between 0-1 representing the overall quality of that request's sources
+- recommended_sources: A list of the most reliable and relevant source URLs of that request
+- improvement_suggestions: Optional suggestions for better source selection
+
+For each source evaluation, include:
+- source_url: The URL being evaluated
+- credibility_score: Score from 0-1
+- relevance_score: Score from 0-1
+- site_type: Type of the site (academic, news, blog, etc.)
+- last_updated: When the content was last updated (if available)
+- author_expertise: Assessment of author expertise (if available)
+- bias_assessment: Potential bias in the source
+- key_insights: Key insights from this source related to the query
+
+USER:
+Evaluate the credibility and relevance of the sources in each of the following {count} requests:
+
+{requests}
+
+ASSISTANT:
+I'll evaluate each request's sources independently and return the results in request order.
+"""
+)
+async def evaluate_sources_batch(count: int, requests: str) -> SourceEvaluationBatch:
+    """
+    Evaluate the sources of several requests in one call.
+    """
+    ...
+
+class SourceEvaluationBatcher:
+    """
+    Collects source evaluations submitted within a short window and answers them
+    with a single Gemini call, so a burst of requests costs one round trip and one
+    request against the rate limit instead of one each.
+    """
+    def __init__(self, window: float = 0.025, max_batch: int = 8):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[asyncio.Future, str, List[str]]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self, question: str, sources: List[str]) -> SourceEvaluationResponse:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, question, sources))
+        if self._flush_task is None:
+            # The batch mixes requests from different clients, so it runs without a deadline
+            self._flush_task = asyncio.create_task(_without_deadline(self._flush))
+        return await await_within_deadline(future)
+
+    async def _flush(self):
+        await asyncio.sleep(self.window)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+        # Cap each call so a large burst doesn't build an unbounded prompt
+        await asyncio.gather(*(
+            self._run(batch[i:i + self.max_batch])
+            for i in range(0, len(batch), self.max_batch)
+        ))
+
+    async def _run(self, batch: List[Tuple[asyncio.Future, str, List[str]]]):
+        try:
+            if len(batch) == 1:
+                _, question, sources = batch[0]
+                results = [await evaluate_sources(question, sources)]
+            else:
+                requests = "\n\n".join(
+                    f"Request {i}:\nQuery: {question}\nSources:\n" + "\n".join(sources)
+                    for i, (_, question, sources) in enumerate(batch, 1)
+                )
+                results = (await evaluate_sources_batch(len(batch), requests)).results
+                if len(results) != len(batch):
+                    # The model didn't return one entry per request; evaluate them one by one
+                    logger.warning("Batched evaluation returned %d results for %d requests", len(results), len(batch))
+                    results = await asyncio.gather(*(
+                        evaluate_sources(question, sources) for _, question, sources in batch
+                    ))
+        except Exception as e:
+            for future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (future, _, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+source_eval_batcher = SourceEvaluationBatcher()
+
+# Minimum credibility x relevance for a source to be recommended
+RECOMMEND_THRESHOLD = 0.6
+
+def merge_evaluations(responses: List[SourceEvaluationResponse], sources: List[str]) -> SourceEvaluationResponse:
+    """
+    Combine single-source evaluations into one response, scoring and picking
+    recommended sources locally
+    """
+    evaluations = [
+        response.evaluations[0].model_copy(update={"source_url": url})
+        for response, url in zip(responses, sources)
+        if response.evaluations
+    ]
+    suggestions = dict.fromkeys(r.improvement_suggestions for r in responses if r.improvement_suggestions)
+    return SourceEvaluationResponse(
+        evaluations=evaluations,
+        overall_quality=sum(r.overall_quality for r in responses) / len(responses) if responses else 0.0,
+        recommended_sources=[
+            e.source_url for e in evaluations
+            if e.credibility_score * e.relevance_score > RECOMMEND_THRESHOLD
+        ],
+        improvement_suggestions=" ".join(suggestions) or None
+    )
+
+# Scholarly publishers and indexes whose sources are scored without an LLM call (subdomains included)
+ACADEMIC_HOSTS = frozenset({
+    'arxiv.org', 'doi.org', 'nih.gov', 'nature.com', 'science.org', 'sciencedirect.com',
+    'springer.com', 'wiley.com', 'jstor.org', 'ieee.org', 'acm.org', 'plos.org',
+    'biorxiv.org', 'medrxiv.org', 'semanticscholar.org', 'cell.com', 'thelancet.com', 'nejm.org'
+})
+
+def _is_academic(url: str) -> bool:
+    """Check whether a URL's host, or any parent domain of it, is in ACADEMIC_HOSTS"""
+    try:
+        labels = (urlsplit(url).hostname or '').split('.')
+    except ValueError:
+        return False
+    return any('.'.join(labels[i:]) in ACADEMIC_HOSTS for i in range(len(labels) - 1))
+
+def fast_path_evaluation(sources: List[str]) -> Optional[SourceEvaluationResponse]:
+    """
+    Deterministic evaluation for inputs that don't need the model: no sources at all,
+    or only sources from scholarly publishers. Returns None for everything else.
+    """
+    if not sources:
+        return SourceEvaluationResponse(
+            evaluations=[],
+            overall_quality=0.0,
+            recommended_sources=[],
+            improvement_suggestions="No sources were provided to evaluate."
+        )
+    if not all(_is_academic(url) for url in sources):
+        return None
+    evaluations = [
+        SourceEvaluation(
+            source_url=url,
+            credibility_score=0.95,
+            relevance_score=0.9,
+            site_type="academic",
+            bias_assessment="Scholarly publisher or index; low expected bias",
+            key_insights=[]
+        )
+        for url in sources
+    ]
+    return SourceEvaluationResponse(
+        evaluations=evaluations,
+        overall_quality=0.95,
+        recommended_sources=list(sources)
+    )
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag using weak comparison (RFC 7232),
+    so tags weakened by compressing proxies still match
+    """
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix('W/')
+    return any(
+        tag == '*' or tag.removeprefix('W/') == opaque
+        for tag in (t.strip() for t in if_none_match.split(','))
+    )
+
+# ETags of recently served bodies by response cache key, so revalidations skip the body lookup
+ETAG_CACHE = TTLCache(maxsize=10000, ttl=3600)
+
+def not_modified(cache_key: str, http_request: Request, max_age: int) -> Optional[Response]:
+    """
+    Answer a revalidation with 304 from the remembered ETag alone, without
+    touching the response cache; None when the body has to be looked up
+    """
+    etag = ETAG_CACHE.get(cache_key)
+    if etag is None or not _etag_matches(http_request.headers.get("if-none-match"), etag):
+        return None
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": f"public, max-age={max_age}"})
+
+def json_response(body: bytes, cache_key: str, http_request: Request, max_age: int) -> Response:
+    """
+    Serve a serialized JSON body with an ETag, answering a matching If-None-Match with 304
+    """
+    etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    ETAG_CACHE[cache_key] = etag
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if _etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def wants_ndjson(http_request: Request) -> bool:
+    """Whether the client asked for a streamed NDJSON response"""
+    return "application/x-ndjson" in http_request.headers.get("accept", "")
+
+async def _stream_partials(stream_call, model, cache: ResponseCache, cache_key: str, *args):
+    """
+    Forward a streamed structured call as NDJSON, one partial result per line,
+    and cache the final result once it validates as a complete model
+    """
+    partial = None
+    try:
+        async with gemini_slot():
+            async for partial in await stream_call(*args):
+                yield dump_json(partial, exclude_none=True) + b"\n"
+    except Exception as e:
+        # Headers are already sent, so end with an error line clients can tell from a result
+        logger.error("Streaming %s failed: %s", model.__name__, e)
+        yield orjson.dumps({"error": str(e)}) + b"\n"
+        return
+
+    try:
+        result = model.model_validate(partial.model_dump() if partial is not None else {})
+    except ValueError as e:
+        logger.warning("Streamed %s was incomplete, not caching: %s", model.__name__, e)
+        yield orjson.dumps({"error": f"Incomplete {model.__name__}"}) + b"\n"
+        return
+    await cache.set(cache_key, dump_json(result))
+
+def ndjson_response(body_or_stream) -> Response:
+    """Serve a cached body as a single NDJSON line, or a live stream of lines"""
+    if isinstance(body_or_stream, bytes):
+        return Response(content=body_or_stream + b"\n", media_type="application/x-ndjson")
+    return StreamingResponse(body_or_stream, media_type="application/x-ndjson")
+
+async def _interpret_body(cache_key: str, question: str) -> bytes:
+    """Generate, serialize and cache a query interpretation"""
+    result = await interpret_query(question)
+    body = dump_json(result)
+    await QUERY_CACHE.set(cache_key, body)
+    return body
+
+async def _evaluate_body(cache_key: str, question: str, sources: List[str]) -> bytes:
+    """Generate, serialize and cache a source evaluation"""
+    # Reuse any sources already evaluated for this question
+    question_key = normalize_question(question)
+    item_keys = [hash_key([question_key, url]) for url in sources]
+    cached = await SOURCE_EVAL_ITEM_CACHE.get_many(item_keys)
+    responses = [
+        SourceEvaluationResponse.model_validate_json(item) if item is not None else None
+        for item in cached
+    ]
+    
+    # One small evaluation per remaining source; the batcher packs them into as few calls as possible
+    missing = [i for i, response in enumerate(responses) if response is None]
+    fresh = await asyncio.gather(*(source_eval_batcher.submit(question, [sources[i]]) for i in missing))
+    for i, response in zip(missing, fresh):
+        responses[i] = response
+    if missing:
+        await SOURCE_EVAL_ITEM_CACHE.set_many([
+            (item_keys[i], dump_json(response)) for i, response in zip(missing, fresh)
+        ])
+    
+    result = merge_evaluations(responses, sources)
+    body = dump_json(result)
+    await SOURCE_EVAL_CACHE.set(cache_key, body)
+    return body
+
 @app.post("/query/interpret", response_model=QueryInterpretation)
-async def interpret_query_endpoint(request: QueryInterpretRequest, response: Response):
+async def interpret_query_endpoint(request: QueryInterpretRequest, http_request: Request):
     """
     Process a query to enhance it with AI interpretation
     """
     try:
-        # Check cache first
-        cache_key = request.question.strip().lower()
-        if cache_key in QUERY_CACHE:
-            return QUERY_CACHE[cache_key]
-        
-        # Generate new interpretation
-        result = await interpret_query(request.question)
-        
-        # Cache the result
-        QUERY_CACHE[cache_key] = result
-        
-        # Enable response caching
-        response.headers["Cache-Control"] = "public, max-age=3600"
+        # Check cache first; cached entries are the serialized response body
+        cache_key = hash_key(normalize_question(request.question))
+        if (revalidated := not_modified(cache_key, http_request, max_age=3600)) is not None:
+            return revalidated
+        body = await QUERY_CACHE.get(cache_key)
+        if wants_ndjson(http_request):
+            # Stream partial interpretations on a miss instead of waiting for the full response
+            if body is None:
+                body = _stream_partials(
+                    interpret_query_stream, QueryInterpretation, QUERY_CACHE, cache_key, request.question
+                )
+            return ndjson_response(body)
+        if body is None:
+            # Concurrent misses for the same question share one interpretation
+            body = await _singleflight(
+                _INTERPRET_INFLIGHT,
+                cache_key,
+                lambda: _interpret_body(cache_key, request.question)
+            )
         
-        return result
+        # Enable response caching and revalidation
+        return json_response(body, cache_key, http_request, max_age=3600)
+    except HTTPException:
+        # Keep deliberate statuses (404, deadline 504, retry 429/503) rather than masking them as 500
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/sources/evaluate", response_model=SourceEvaluationResponse)
-async def evaluate_sources_endpoint(request: SourceEvaluationRequest, response: Response):
+async def evaluate_sources_endpoint(request: SourceEvaluationRequest, http_request: Request):
     """
     Evaluate the credibility and relevance of provided sources
     """
     try:
-        # Generate cache key from sorted sources and question
-        sources_key = "-".join(sorted(request.sources))
-        cache_key = f"{request.question.strip().lower()}:{sources_key}"
+        # Canonical, de-duplicated sources feed both the cache key and the prompt
+        sources = sorted(dict.fromkeys(normalize_url(url) for url in request.sources))
         
-        # Check cache first
-        if cache_key in SOURCE_EVAL_CACHE:
-            return SOURCE_EVAL_CACHE[cache_key]
+        # Generate a fixed-size cache key from the question and sources
+        cache_key = hash_key([normalize_question(request.question), sources])
+        if (revalidated := not_modified(cache_key, http_request, max_age=7200)) is not None:
+            return revalidated
         
-        # Get evaluation result
-        result = await evaluate_sources(request.question, request.sources)
-        
-        # Cache the result
-        SOURCE_EVAL_CACHE[cache_key] = result
-        
-        # Enable response caching
-        response.headers["Cache-Control"] = "public, max-age=7200"
+        # Trivial source lists are answered directly; otherwise check the cache,
+        # whose entries are the serialized response body
+        result = fast_path_evaluation(sources)
+        body = dump_json(result) if result is not None else await SOURCE_EVAL_CACHE.get(cache_key)
+        if wants_ndjson(http_request):
+            # Streams come from the single-prompt evaluation, whose scores differ from the
+            # merged per-source ones, so they're cached apart and never served to JSON clients
+            if body is None:
+                body = await SOURCE_EVAL_STREAM_CACHE.get(cache_key)
+            # Stream partial evaluations on a miss instead of waiting for the full response
+            if body is None:
+                body = _stream_partials(
+                    evaluate_sources_stream, SourceEvaluationResponse, SOURCE_EVAL_STREAM_CACHE, cache_key,
+                    request.question, sources
+                )
+            return ndjson_response(body)
+        if body is None:
+            # Concurrent misses for the same question and sources share one evaluation
+            body = await _singleflight(
+                _SOURCE_EVAL_INFLIGHT,
+                cache_key,
+                lambda: _evaluate_body(cache_key, request.question, sources)
+            )
         
-        return result
+        # Enable response caching and revalidation
+        return json_response(body, cache_key, http_request, max_age=7200)
+    except HTTPException:
+        # Keep deliberate statuses (404, deadline 504, retry 429/503) rather than masking them as 500
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Warm-up only proceeds while this many request slots per window are left for live traffic
+WARM_RESERVED_SLOTS = gemini_rate_limiter.rpm_limit // 2
+# One worker per deploy warms the shared Redis caches; the lock expires well after it's done
+WARM_LOCK_KEY = "warmup:lock"
+WARM_LOCK_TTL = 600
+
+async def _warm_entry(entry: Any) -> bool:
+    """Warm the caches for one recorded request; False if the entry isn't usable"""
+    if isinstance(entry, str):
+        entry = {"question": entry}
+    if not isinstance(entry, dict):
+        return False
+    question = entry.get("question")
+    if not isinstance(question, str) or not question.strip():
+        return False
+
+    cache_key = hash_key(normalize_question(question))
+    if await QUERY_CACHE.get(cache_key) is None:
+        await _singleflight(_INTERPRET_INFLIGHT, cache_key, lambda: _interpret_body(cache_key, question))
+
+    sources = entry.get("sources")
+    if isinstance(sources, list) and sources and all(isinstance(url, str) for url in sources):
+        sources = sorted(dict.fromkeys(normalize_url(url) for url in sources))
+        cache_key = hash_key([normalize_question(question), sources])
+        if fast_path_evaluation(sources) is None and await SOURCE_EVAL_CACHE.get(cache_key) is None:
+            await _singleflight(
+                _SOURCE_EVAL_INFLIGHT, cache_key, lambda: _evaluate_body(cache_key, question, sources)
+            )
+    return True
+
+async def warm_caches(path: str):
+    """
+    Replay recorded frequent requests so the first users after a deploy hit warm caches.
+    The file is a JSON list whose entries are either a question string or an object
+    with "question" and optional "sources", as sent to /sources/evaluate.
+    """
+    try:
+        with open(path, 'rb') as f:
+            entries = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError) as e:
+        logger.warning("Skipping cache warm-up, can't read %s: %s", path, e)
+        return
+    if not isinstance(entries, list):
+        logger.warning("Skipping cache warm-up, %s doesn't hold a JSON list", path)
+        return
+
+    if redis_client is not None:
+        try:
+            if not await redis_client.set(WARM_LOCK_KEY, os.getpid(), nx=True, ex=WARM_LOCK_TTL):
+                logger.info("Skipping cache warm-up, another worker is running it")
+                return
+        except redis.RedisError as e:
+            logger.warning("Skipping cache warm-up, can't take the Redis lock: %s", e)
+            return
+
+    warmed = 0
+    # One entry at a time, and only while the limiter has room to spare for live traffic
+    for entry in entries:
+        while gemini_rate_limiter.headroom() <= WARM_RESERVED_SLOTS:
+            await asyncio.sleep(5)
+        try:
+            warmed += await _warm_entry(entry)
+        except Exception as e:
+            logger.warning("Cache warm-up failed for %r: %s", entry, e)
+    logger.info("Cache warm-up finished: %d of %d entries", warmed, len(entries))
+
+@app.on_event("startup")
+async def start_cache_warmup():
+    """Warm the response caches in the background from WARM_QUERIES_FILE, if set"""
+    app.state.warmup_task = None
+    if path := os.getenv("WARM_QUERIES_FILE"):
+        app.state.warmup_task = asyncio.create_task(warm_caches(path))
+
+@app.on_event("shutdown")
+async def stop_cache_warmup():
+    """Stop an unfinished warm-up so shutdown isn't held up by Gemini calls"""
+    if app.state.warmup_task is not None:
+        app.state.warmup_task.cancel()